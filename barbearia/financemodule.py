@@ -11,26 +11,88 @@ Features:
 - CORS enabled for frontend integration.
 """
 from __future__ import annotations
-from fastapi import FastAPI, HTTPException, Depends, Query, Body
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Depends, Query, Body, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-from datetime import datetime, date
+from typing import Optional, List, Dict, Any, Tuple, Callable
+from datetime import datetime, date, time, timedelta, timezone
 import sqlite3
 import os
 import csv
-from collections import defaultdict
+import io
+import queue
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import monotonic
 
 DB_PATH = os.environ.get('SAAS_FINANCE_DB', 'saas_finance_api.db')
 
 # -----------------
 # DB init (same schema)
 # -----------------
+# Timestamps are stored as the wall-clock time the client sent, in microseconds
+# since 1970-01-01, with any UTC offset kept separately in tz_offset (seconds).
+# Periods are therefore bucketed by the timestamp's own date, as with the old
+# ISO-8601 strings, and timestamps round-trip with their offset and fraction.
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_epoch(ts: datetime) -> int:
+    return (ts.replace(tzinfo=None) - _EPOCH) // _MICROSECOND
+
+
+def _utc_offset(ts: datetime) -> Optional[int]:
+    offset = ts.utcoffset()
+    return None if offset is None else int(offset.total_seconds())
+
+
+def _from_epoch(value: int, offset: Optional[int]) -> datetime:
+    ts = _EPOCH + value * _MICROSECOND
+    return ts if offset is None else ts.replace(tzinfo=timezone(timedelta(seconds=offset)))
+
+
+def _needs_timestamp_migration(cur: sqlite3.Cursor, table: str) -> bool:
+    cur.execute(f'PRAGMA table_info({table})')
+    columns = [col[1] for col in cur.fetchall()]
+    return bool(columns) and 'tz_offset' not in columns
+
+
+def _copy_legacy_rows(cur: sqlite3.Cursor, table: str):
+    # older databases stored ISO-8601 strings; convert them once
+    cur.execute(f'SELECT * FROM {table}_legacy')
+    names = [d[0] for d in cur.description]
+    ts_idx = names.index('timestamp')
+    rows = []
+    for row in cur.fetchall():
+        row = list(row)
+        offset = None
+        if row[ts_idx] is not None:
+            ts = datetime.fromisoformat(row[ts_idx])
+            row[ts_idx] = _to_epoch(ts)
+            offset = _utc_offset(ts)
+        rows.append(row + [offset])
+    names.append('tz_offset')
+    cur.executemany(f'INSERT INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})', rows)
+    cur.execute(f'DROP TABLE {table}_legacy')
+
+
 def ensure_db(db_path: str = DB_PATH):
     init_needed = not os.path.exists(db_path)
     conn = sqlite3.connect(db_path)
+    # WAL is persistent in the database file, so it only needs to be set once
+    conn.execute('PRAGMA journal_mode=WAL')
     cur = conn.cursor()
+    # take the write lock before inspecting the schema, so workers starting together
+    # serialize the check-then-migrate instead of failing to upgrade a read snapshot
+    conn.execute('BEGIN IMMEDIATE')
+    legacy = [t for t in ('transactions', 'expenses') if _needs_timestamp_migration(cur, t)]
+    for table in legacy:
+        cur.execute(f'ALTER TABLE {table} RENAME TO {table}_legacy')
     cur.execute('''
         CREATE TABLE IF NOT EXISTS barbers (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -53,7 +115,8 @@ def ensure_db(db_path: str = DB_PATH):
             service_id INTEGER,
             price REAL,
             payment_method TEXT,
-            timestamp TEXT,
+            timestamp INTEGER,
+            tz_offset INTEGER,
             note TEXT
         )
     ''')
@@ -63,9 +126,16 @@ def ensure_db(db_path: str = DB_PATH):
             description TEXT,
             category TEXT,
             amount REAL,
-            timestamp TEXT
+            timestamp INTEGER,
+            tz_offset INTEGER
         )
     ''')
+    for table in legacy:
+        _copy_legacy_rows(cur, table)
+    # timestamps are integers, so the period filters are integer range scans
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_tx_timestamp ON transactions(timestamp)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_exp_timestamp ON expenses(timestamp)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_tx_barber ON transactions(barber_id)')
     conn.commit()
     conn.close()
 
@@ -109,199 +179,444 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Utility DB connection
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# Utility DB connection pool
+_POOL: 'queue.Queue[sqlite3.Connection]' = queue.Queue(maxsize=8)
+
+
+def _connect() -> sqlite3.Connection:
+    # connections travel between worker threads through the pool, never used by two at once
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    # WAL only needs fsync on checkpoint, so NORMAL is still durable against app crashes
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA cache_size=-65536')
     return conn
 
+
+@contextmanager
+def get_conn():
+    try:
+        conn = _POOL.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+    finally:
+        # never hand a half-finished transaction to the next borrower
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _POOL.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
 # -----------------
 # CRUD endpoints
 # -----------------
 @app.post('/barbers', status_code=201)
 def create_barber(b: BarberIn):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('INSERT INTO barbers (name, commission_type, commission_value) VALUES (?, ?, ?)',
-                (b.name, b.commission_type, b.commission_value))
-    conn.commit()
-    barber_id = cur.lastrowid
-    conn.close()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute('INSERT INTO barbers (name, commission_type, commission_value) VALUES (?, ?, ?)',
+                    (b.name, b.commission_type, b.commission_value))
+        conn.commit()
+        barber_id = cur.lastrowid
+    # a new barber can change the commission rule applied to existing transactions
+    _invalidate_reports()
     return {'id': barber_id}
 
 @app.post('/services', status_code=201)
 def create_service(s: ServiceIn):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('INSERT INTO services (name, base_price) VALUES (?, ?)', (s.name, float(s.base_price)))
-    conn.commit()
-    sid = cur.lastrowid
-    conn.close()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute('INSERT INTO services (name, base_price) VALUES (?, ?)', (s.name, float(s.base_price)))
+        conn.commit()
+        sid = cur.lastrowid
     return {'id': sid}
 
 @app.post('/transactions', status_code=201)
 def create_transaction(t: TransactionIn):
     ts = t.timestamp or datetime.now()
     price = t.price
-    if price is None:
-        # fetch service base price
-        conn = get_conn()
+    with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute('SELECT base_price FROM services WHERE id = ?', (t.service_id,))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            raise HTTPException(status_code=400, detail='service_id not found and no price provided')
-        price = float(row['base_price'])
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('INSERT INTO transactions (barber_id, service_id, price, payment_method, timestamp, note) VALUES (?, ?, ?, ?, ?, ?)',
-                (t.barber_id, t.service_id, float(price), t.payment_method, ts.isoformat(), t.note))
-    conn.commit()
-    tid = cur.lastrowid
-    conn.close()
+        if price is None:
+            # fetch service base price
+            cur.execute('SELECT base_price FROM services WHERE id = ?', (t.service_id,))
+            row = cur.fetchone()
+            if not row:
+                raise HTTPException(status_code=400, detail='service_id not found and no price provided')
+            price = float(row[0])
+        cur.execute('INSERT INTO transactions (barber_id, service_id, price, payment_method, timestamp, tz_offset, note) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (t.barber_id, t.service_id, float(price), t.payment_method, _to_epoch(ts), _utc_offset(ts), t.note))
+        conn.commit()
+        tid = cur.lastrowid
+    _invalidate_reports([ts])
     return {'id': tid}
 
 @app.post('/expenses', status_code=201)
 def create_expense(e: ExpenseIn):
     ts = e.timestamp or datetime.now()
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('INSERT INTO expenses (description, category, amount, timestamp) VALUES (?, ?, ?, ?)',
-                (e.description, e.category, float(e.amount), ts.isoformat()))
-    conn.commit()
-    eid = cur.lastrowid
-    conn.close()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute('INSERT INTO expenses (description, category, amount, timestamp, tz_offset) VALUES (?, ?, ?, ?, ?)',
+                    (e.description, e.category, float(e.amount), _to_epoch(ts), _utc_offset(ts)))
+        conn.commit()
+        eid = cur.lastrowid
+    _invalidate_reports([ts])
     return {'id': eid}
 
+@app.post('/transactions/bulk', status_code=201)
+def create_transactions_bulk(items: List[TransactionIn]):
+    now = datetime.now()
+    missing = {t.service_id for t in items if t.price is None}
+    with get_conn() as conn:
+        cur = conn.cursor()
+        base_prices = {}
+        if missing:
+            # resolve every missing price in one lookup instead of one per item
+            placeholders = ', '.join('?' * len(missing))
+            cur.execute(f'SELECT id, base_price FROM services WHERE id IN ({placeholders})', tuple(missing))
+            base_prices = dict(cur.fetchall())
+            unknown = missing - base_prices.keys()
+            if unknown:
+                raise HTTPException(status_code=400,
+                                    detail=f'service_id {sorted(unknown)} not found and no price provided')
+        rows = [(t.barber_id, t.service_id, float(t.price if t.price is not None else base_prices[t.service_id]),
+                 t.payment_method, _to_epoch(t.timestamp or now), _utc_offset(t.timestamp or now), t.note)
+                for t in items]
+        # one explicit transaction -> a single commit for the whole batch
+        conn.execute('BEGIN')
+        cur.executemany('INSERT INTO transactions (barber_id, service_id, price, payment_method, timestamp, tz_offset, note) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        rows)
+        conn.commit()
+    _invalidate_reports([t.timestamp or now for t in items])
+    return {'inserted': len(rows)}
+
+@app.post('/expenses/bulk', status_code=201)
+def create_expenses_bulk(items: List[ExpenseIn]):
+    now = datetime.now()
+    rows = [(e.description, e.category, float(e.amount), _to_epoch(e.timestamp or now), _utc_offset(e.timestamp or now))
+            for e in items]
+    with get_conn() as conn:
+        conn.execute('BEGIN')
+        conn.executemany('INSERT INTO expenses (description, category, amount, timestamp, tz_offset) VALUES (?, ?, ?, ?, ?)', rows)
+        conn.commit()
+    _invalidate_reports([e.timestamp or now for e in items])
+    return {'inserted': len(rows)}
+
 # -----------------
 # Reporting helpers
 # -----------------
 
-def _in_period(ts: datetime, period: str, reference_date: date) -> bool:
+def _period_bounds(period: str, reference_date: date) -> Tuple[int, int]:
+    """Return the half-open ``[start, end)`` wall-clock epoch range covering the period."""
     if period == 'daily':
-        return ts.date() == reference_date
+        start = reference_date
+        end = start + timedelta(days=1)
     elif period == 'weekly':
-        return ts.isocalendar()[:2] == reference_date.isocalendar()[:2]
+        iso_year, iso_week, _ = reference_date.isocalendar()
+        start = date.fromisocalendar(iso_year, iso_week, 1)
+        end = start + timedelta(days=7)
     elif period == 'monthly':
-        return (ts.year, ts.month) == (reference_date.year, reference_date.month)
+        start = reference_date.replace(day=1)
+        if start.month == 12:
+            end = start.replace(year=start.year + 1, month=1)
+        else:
+            end = start.replace(month=start.month + 1)
     else:
         raise ValueError('period must be daily, weekly or monthly')
+    return _to_epoch(datetime.combine(start, time.min)), _to_epoch(datetime.combine(end, time.min))
 
 
-def _load_transactions_for_period(period: str, reference_date: date) -> List[Dict[str, Any]]:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('SELECT id, barber_id, service_id, price, payment_method, timestamp, note FROM transactions')
-    rows = cur.fetchall()
-    conn.close()
-    results = []
-    for r in rows:
-        ts = datetime.fromisoformat(r['timestamp'])
-        if _in_period(ts, period, reference_date):
-            results.append({
-                'id': r['id'], 'barber_id': r['barber_id'], 'service_id': r['service_id'], 'price': r['price'],
-                'payment_method': r['payment_method'], 'timestamp': datetime.fromisoformat(r['timestamp']), 'note': r['note']
-            })
-    return results
-
-
-def _load_expenses_for_period(period: str, reference_date: date) -> List[Dict[str, Any]]:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('SELECT id, description, category, amount, timestamp FROM expenses')
+def _make_period_predicate(period: str, reference_date: date) -> Callable[[List[int]], bool]:
+    """Return a test for whether any of a sorted list of epoch timestamps falls inside the period."""
+    start, end = _period_bounds(period, reference_date)
+
+    def touches_period(epochs: List[int]) -> bool:
+        i = bisect_left(epochs, start)
+        return i < len(epochs) and epochs[i] < end
+    return touches_period
+
+
+def _range_clause(start: Optional[int], end: Optional[int]) -> Tuple[str, List[int]]:
+    conditions, params = [], []
+    if start is not None:
+        conditions.append('timestamp >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append('timestamp < ?')
+        params.append(end)
+    return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+
+def _fetch_transactions(cur: sqlite3.Cursor, start: Optional[int] = None, end: Optional[int] = None,
+                        limit: int = -1, offset: int = 0) -> List[Dict[str, Any]]:
+    where, params = _range_clause(start, end)
+    cur.execute('SELECT id, barber_id, service_id, price, payment_method, timestamp, tz_offset, note FROM transactions'
+                + where + ' ORDER BY timestamp, id LIMIT ? OFFSET ?', (*params, limit, offset))
     rows = cur.fetchall()
-    conn.close()
-    results = []
-    for r in rows:
-        ts = datetime.fromisoformat(r['timestamp'])
-        if _in_period(ts, period, reference_date):
-            results.append({'id': r['id'], 'description': r['description'], 'category': r['category'], 'amount': r['amount'], 'timestamp': datetime.fromisoformat(r['timestamp'])})
-    return results
+    return [{
+        'id': rid, 'barber_id': bid, 'service_id': sid, 'price': price,
+        'payment_method': pm, 'timestamp': _from_epoch(ts, tz_offset) if ts is not None else None, 'note': note
+    } for rid, bid, sid, price, pm, ts, tz_offset, note in rows]
 
 
-def _calculate_commissions(transactions: List[Dict[str, Any]], default_percent: float = 30.0) -> Dict[int, float]:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('SELECT id, commission_type, commission_value FROM barbers')
+def _fetch_expenses(cur: sqlite3.Cursor, start: Optional[int] = None, end: Optional[int] = None,
+                    limit: int = -1, offset: int = 0) -> List[Dict[str, Any]]:
+    where, params = _range_clause(start, end)
+    cur.execute('SELECT id, description, category, amount, timestamp, tz_offset FROM expenses'
+                + where + ' ORDER BY timestamp, id LIMIT ? OFFSET ?', (*params, limit, offset))
     rows = cur.fetchall()
-    conn.close()
-    barber_settings = {r['id']: (r['commission_type'], r['commission_value']) for r in rows}
-
-    commissions = defaultdict(float)
-    for t in transactions:
-        bid = t['barber_id']
-        price = float(t['price'])
-        setting = barber_settings.get(bid, (None, None))
-        if setting[0] == 'percent' and setting[1] is not None:
-            pct = float(setting[1])
-            commissions[bid] += price * (pct / 100.0)
-        elif setting[0] == 'fixed' and setting[1] is not None:
-            commissions[bid] += float(setting[1])
-        else:
-            commissions[bid] += price * (default_percent / 100.0)
-    return dict(commissions)
+    return [{'id': eid, 'description': desc, 'category': category, 'amount': amount,
+             'timestamp': _from_epoch(ts, tz_offset) if ts is not None else None}
+            for eid, desc, category, amount, ts, tz_offset in rows]
 
-# -----------------
-# Report endpoints
-# -----------------
-@app.get('/report')
-def get_report(period: str = Query('monthly', regex='^(daily|weekly|monthly)$'),
-               reference_date: Optional[date] = Query(None, description='YYYY-MM-DD')):
-    if reference_date is None:
-        reference_date = date.today()
-    txs = _load_transactions_for_period(period, reference_date)
-    exps = _load_expenses_for_period(period, reference_date)
-
-    counts = defaultdict(int)
-    totals = defaultdict(float)
-    totals_by_service = defaultdict(float)
-    total_revenue = 0.0
-    for t in txs:
-        counts[t['barber_id']] += 1
-        totals[t['barber_id']] += float(t['price'])
-        totals_by_service[t['service_id']] += float(t['price'])
-        total_revenue += float(t['price'])
-
-    total_expenses = sum(float(e['amount']) for e in exps)
+
+def _calculate_commissions(cur: sqlite3.Cursor, bounds: Tuple[int, int], default_percent: float = 30.0) -> Dict[int, float]:
+    cur.execute('''
+        SELECT t.barber_id,
+               SUM(CASE
+                   WHEN b.commission_type = 'percent' AND b.commission_value IS NOT NULL
+                       THEN t.price * b.commission_value / 100.0
+                   WHEN b.commission_type = 'fixed' AND b.commission_value IS NOT NULL
+                       THEN b.commission_value
+                   ELSE t.price * ? / 100.0
+               END)
+        FROM transactions t
+        LEFT JOIN barbers b ON b.id = t.barber_id
+        WHERE t.timestamp >= ? AND t.timestamp < ?
+        GROUP BY t.barber_id
+    ''', (default_percent, *bounds))
+    return dict(cur.fetchall())
+
+
+# the per-group aggregations return the executed cursor; callers read its rows
+def _query_barber_totals(cur: sqlite3.Cursor, bounds: Tuple[int, int]) -> sqlite3.Cursor:
+    return cur.execute('SELECT barber_id, COUNT(*), SUM(price) FROM transactions '
+                       'WHERE timestamp >= ? AND timestamp < ? GROUP BY barber_id', bounds)
+
+
+def _query_service_totals(cur: sqlite3.Cursor, bounds: Tuple[int, int]) -> sqlite3.Cursor:
+    return cur.execute('SELECT service_id, SUM(price) FROM transactions '
+                       'WHERE timestamp >= ? AND timestamp < ? GROUP BY service_id', bounds)
+
+
+def _query_payment_method_totals(cur: sqlite3.Cursor, bounds: Tuple[int, int]) -> sqlite3.Cursor:
+    return cur.execute('SELECT payment_method, SUM(price) FROM transactions '
+                       'WHERE timestamp >= ? AND timestamp < ? GROUP BY payment_method', bounds)
+
+
+def _query_category_totals(cur: sqlite3.Cursor, bounds: Tuple[int, int]) -> sqlite3.Cursor:
+    return cur.execute('SELECT category, SUM(amount) FROM expenses '
+                       'WHERE timestamp >= ? AND timestamp < ? GROUP BY category', bounds)
+
+
+def _query_expense_total(cur: sqlite3.Cursor, bounds: Tuple[int, int]) -> float:
+    cur.execute('SELECT COALESCE(SUM(amount), 0.0) FROM expenses WHERE timestamp >= ? AND timestamp < ?', bounds)
+    return cur.fetchone()[0]
+
+
+def _build_report(period: str, reference_date: date, include_rows: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """Build the report payload for the period along with its ETag.
+
+    The raw ``transactions``/``expenses`` lists are only loaded when ``include_rows`` is set.
+    """
+    bounds = _period_bounds(period, reference_date)
+    rows = {}
+    with get_conn() as conn:
+        cur = conn.cursor()
+        # one read transaction, so the ETag ids and every figure come from the same snapshot
+        conn.execute('BEGIN')
+        # any insert bumps one of these, so they version the report contents
+        cur.execute('SELECT (SELECT MAX(id) FROM transactions), (SELECT MAX(id) FROM expenses), '
+                    '(SELECT MAX(id) FROM barbers)')
+        last_ids = cur.fetchone()
+        by_barber = _query_barber_totals(cur, bounds).fetchall()
+        totals_by_service = dict(_query_service_totals(cur, bounds).fetchall())
+        totals_by_payment_method = dict(_query_payment_method_totals(cur, bounds).fetchall())
+        totals_by_category = dict(_query_category_totals(cur, bounds).fetchall())
+        total_expenses = _query_expense_total(cur, bounds)
+        commissions_due = _calculate_commissions(cur, bounds)
+        if include_rows:
+            rows['transactions'] = _fetch_transactions(cur, *bounds)
+            rows['expenses'] = _fetch_expenses(cur, *bounds)
+        conn.commit()
+
+    counts = {bid: cuts for bid, cuts, _ in by_barber}
+    totals = {bid: total for bid, _, total in by_barber}
+    total_revenue = sum(totals.values(), 0.0)
     net_profit = total_revenue - total_expenses
-    commissions_due = _calculate_commissions(txs)
 
-    return {
+    etag = '"{}-{}-{}{}"'.format(period, reference_date, '-'.join(str(i or 0) for i in last_ids),
+                                 '-rows' if include_rows else '')
+    report = {
         'period': period,
         'reference_date': str(reference_date),
-        'counts_by_barber': dict(counts),
-        'totals_by_barber': dict(totals),
-        'totals_by_service': dict(totals_by_service),
+        'counts_by_barber': counts,
+        'totals_by_barber': totals,
+        'totals_by_service': totals_by_service,
+        'totals_by_payment_method': totals_by_payment_method,
+        'totals_by_category': totals_by_category,
         'total_revenue': total_revenue,
         'total_expenses': total_expenses,
         'net_profit': net_profit,
         'commissions_due': commissions_due,
-        'transactions': txs,
-        'expenses': exps
+        **rows,
     }
+    return etag, report
+
+# -----------------
+# Report cache
+# -----------------
+# In-process only: with several workers each keeps its own copy, and a write
+# handled by one worker does not invalidate the others, so every entry expires.
+REPORT_CACHE_SIZE = 256
+REPORT_CACHE_TTL = 30.0  # seconds, for periods that are still open
+REPORT_CACHE_CLOSED_TTL = 600.0  # seconds, for periods that have ended
+
+_report_cache: 'OrderedDict[Tuple[str, date, bool], Tuple[float, str, Dict[str, Any], Callable[[List[int]], bool]]]' = OrderedDict()
+_report_cache_lock = threading.Lock()
+# bumped by every invalidation; a report built across a bump may predate the write
+_report_generation = 0
+
+
+def _cached_report(key: Tuple[str, date, bool]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    with _report_cache_lock:
+        entry = _report_cache.get(key)
+        if entry is None:
+            return None
+        expiry, etag, payload, _ = entry
+        if expiry < monotonic():
+            del _report_cache[key]
+            return None
+        _report_cache.move_to_end(key)
+        return etag, payload
+
+
+def _store_report(key: Tuple[str, date, bool], etag: str, payload: Dict[str, Any], generation: int):
+    """Cache a report built after observing ``generation``, unless a write has invalidated since."""
+    period, reference_date, _ = key
+    _, end = _period_bounds(period, reference_date)
+    closed = end <= _to_epoch(datetime.now())
+    expiry = monotonic() + (REPORT_CACHE_CLOSED_TTL if closed else REPORT_CACHE_TTL)
+    touches_period = _make_period_predicate(period, reference_date)
+    with _report_cache_lock:
+        if generation != _report_generation:
+            return
+        _report_cache[key] = (expiry, etag, payload, touches_period)
+        _report_cache.move_to_end(key)
+        while len(_report_cache) > REPORT_CACHE_SIZE:
+            _report_cache.popitem(last=False)
+
+
+def _invalidate_reports(timestamps: Optional[List[datetime]] = None):
+    """Drop cached reports whose period contains any of ``timestamps`` (all of them if None)."""
+    global _report_generation
+    # the async report endpoint takes this lock on the event loop, so do the conversion outside it
+    epochs = sorted({_to_epoch(ts) for ts in timestamps}) if timestamps is not None else None
+    with _report_cache_lock:
+        _report_generation += 1
+        if epochs is None:
+            _report_cache.clear()
+            return
+        stale = [key for key, entry in _report_cache.items() if entry[3](epochs)]
+        for key in stale:
+            del _report_cache[key]
+
+# -----------------
+# Report endpoints
+# -----------------
+def _resolve_ref_date(reference_date: Optional[date] = Query(None, description='YYYY-MM-DD')) -> date:
+    return reference_date or date.today()
+
+
+@app.get('/report')
+async def get_report(request: Request, response: Response,
+                     period: str = Query('monthly', regex='^(daily|weekly|monthly)$'),
+                     reference_date: date = Depends(_resolve_ref_date),
+                     include_rows: bool = Query(False, description='Include the raw transactions/expenses lists')):
+    key = (period, reference_date, include_rows)
+    # cache hits and 304s are answered on the event loop; only a miss touches SQLite
+    cached = _cached_report(key)
+    if cached is None:
+        generation = _report_generation
+        etag, payload = await run_in_threadpool(_build_report, period, reference_date, include_rows)
+        _store_report(key, etag, payload, generation)
+    else:
+        etag, payload = cached
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return payload
 
 @app.get('/export_csv')
-def export_csv(period: str = Query('monthly', regex='^(daily|weekly|monthly)$'), reference_date: Optional[date] = Query(None)):
-    if reference_date is None:
-        reference_date = date.today()
-    report = get_report(period, reference_date)
-    path = f'report_{period}_{reference_date}.csv'
-    with open(path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['BARBER_ID', 'CUTS', 'TOTAL'])
-        for bid, cuts in report['counts_by_barber'].items():
-            writer.writerow([bid, cuts, f"{report['totals_by_barber'].get(bid, 0.0):.2f}"])
-        writer.writerow([])
-        writer.writerow(['SERVICE_ID', 'TOTAL'])
-        for sid, total in report['totals_by_service'].items():
-            writer.writerow([sid, f"{total:.2f}"])
-        writer.writerow([])
-        writer.writerow(['TOTAL_REVENUE', f"{report['total_revenue']:.2f}"])
-        writer.writerow(['TOTAL_EXPENSES', f"{report['total_expenses']:.2f}"])
-        writer.writerow(['NET_PROFIT', f"{report['net_profit']:.2f}"])
-    return FileResponse(path, filename=os.path.basename(path), media_type='text/csv')
+async def export_csv(period: str = Query('monthly', regex='^(daily|weekly|monthly)$'),
+                     reference_date: date = Depends(_resolve_ref_date)):
+    bounds = _period_bounds(period, reference_date)
+
+    def row_iter():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+
+        def line(row) -> str:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerow(row)
+            return buf.getvalue()
+
+        with get_conn() as conn:
+            cur = conn.cursor()
+            yield line(['BARBER_ID', 'CUTS', 'TOTAL'])
+            total_revenue = 0.0
+            for bid, cuts, total in _query_barber_totals(cur, bounds):
+                total_revenue += total
+                yield line([bid, cuts, f"{total:.2f}"])
+            yield line([])
+            yield line(['SERVICE_ID', 'TOTAL'])
+            for sid, total in _query_service_totals(cur, bounds):
+                yield line([sid, f"{total:.2f}"])
+            yield line([])
+            yield line(['PAYMENT_METHOD', 'TOTAL'])
+            for method, total in _query_payment_method_totals(cur, bounds):
+                yield line([method, f"{total:.2f}"])
+            yield line([])
+            yield line(['EXPENSE_CATEGORY', 'TOTAL'])
+            for category, total in _query_category_totals(cur, bounds):
+                yield line([category, f"{total:.2f}"])
+            total_expenses = _query_expense_total(cur, bounds)
+        yield line([])
+        yield line(['TOTAL_REVENUE', f"{total_revenue:.2f}"])
+        yield line(['TOTAL_EXPENSES', f"{total_expenses:.2f}"])
+        yield line(['NET_PROFIT', f"{total_revenue - total_expenses:.2f}"])
+
+    # StreamingResponse drives the sync generator from the threadpool
+    filename = f'report_{period}_{reference_date}.csv'
+    return StreamingResponse(row_iter(), media_type='text/csv',
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+# rows are stored by local wall-clock time, so the bounds compare on that too
+_FROM_DESCRIPTION = 'Inclusive lower bound on the wall-clock time as sent; any UTC offset is ignored'
+_TO_DESCRIPTION = 'Exclusive upper bound on the wall-clock time as sent; any UTC offset is ignored'
+
+
+@app.get('/transactions')
+def list_transactions(from_: Optional[datetime] = Query(None, alias='from', description=_FROM_DESCRIPTION),
+                      to: Optional[datetime] = Query(None, description=_TO_DESCRIPTION),
+                      limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    with get_conn() as conn:
+        return _fetch_transactions(conn.cursor(), _to_epoch(from_) if from_ else None, _to_epoch(to) if to else None,
+                                   limit, offset)
+
+@app.get('/expenses')
+def list_expenses(from_: Optional[datetime] = Query(None, alias='from', description=_FROM_DESCRIPTION),
+                  to: Optional[datetime] = Query(None, description=_TO_DESCRIPTION),
+                  limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    with get_conn() as conn:
+        return _fetch_expenses(conn.cursor(), _to_epoch(from_) if from_ else None, _to_epoch(to) if to else None,
+                               limit, offset)
 
 @app.get('/health')
-def health():
+async def health():
     return {'status': 'ok'}